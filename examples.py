@@ -1,5 +1,12 @@
 import socketscpi
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+# Command templates used to create and display a VNA measurement, formatted once per measurement and sent as one message
+VNA_MEAS_SETUP = ('display:window{window}:state on',
+                  'calc1:parameter:define "{measName}", "{param}"',
+                  'display:window{window}:trace{trace}:feed "{measName}"',
+                  'calc1:parameter:select "{measName}"')
 
 
 def awg_example(ipAddress, port=5025):
@@ -13,31 +20,40 @@ def awg_example(ipAddress, port=5025):
     freq = 100e6
     res = 'wsp'
 
-    awg.write('func:mode arb')
-    awg.write(f'trace1:dwidth {res}')
-    awg.write(f'frequency:raster {fs}')
-
-    awg.write('output1:route dac')
-    awg.write('output1:norm on')
+    awg.write_many(['func:mode arb',
+                    f'trace1:dwidth {res}',
+                    f'frequency:raster {fs}',
+                    'output1:route dac',
+                    'output1:norm on'])
 
-    rl = int(fs / freq * 64)
-    t = np.linspace(0, rl / fs, rl, endpoint=False)
-    wfm = np.array(2047 * np.sin(2 * np.pi * freq * t), dtype=np.int16) << 4
+    # The record holds 64 whole cycles, so compute a single cycle and tile it rather than evaluating sin() for every sample
+    cycles = 64
+    spc = int(fs / freq)
+    rl = spc * cycles
+    # Scale to 12 bits and shift into the upper 12 bits before the cast so only one int16 array is created (lower 4 bits stay clear)
+    period = (np.trunc(2047 * np.sin(2 * np.pi * np.arange(spc) / spc)) * 16).astype(np.int16)
+    wfm = np.tile(period, cycles)
 
     awg.write(f'trace:def 1, {rl}')
     awg.write_binary_values('trace:data 1, 0, ', wfm)
 
-    awg.write('trace:select 1')
-    awg.write('init:cont on')
-    awg.write('init:imm')
-    awg.query('*opc?')
+    awg.write_many(['trace:select 1', 'init:cont on', 'init:imm'], wait=True)
 
     awg.err_check()
     awg.close()
 
 
-def vna_example(ipAddress, port=5025):
-    """Test generic VNA connection, sweep control, and data transfer."""
+def vna_example(ipAddress, port=5025, precision='f32'):
+    """Test generic VNA connection, sweep control, and data transfer.
+
+    precision selects the binary format of the trace data, 'f32' (default, half the bytes on the wire) or 'f64'."""
+    if precision == 'f32':
+        fmt, datatype = 'real,32', 'f'
+    elif precision == 'f64':
+        fmt, datatype = 'real,64', 'd'
+    else:
+        raise ValueError("precision must be 'f32' or 'f64'.")
+
     vna = socketscpi.SocketInstrument(ipAddress=ipAddress, port=port, timeout=10, log=False)
     print(vna.instId)
 
@@ -45,22 +61,16 @@ def vna_example(ipAddress, port=5025):
     vna.query('*opc?')
 
     measName = 'meas1'
-    vna.write('display:window1:state on')
-    vna.write(f'calc1:parameter:define "{measName}", "S11"')
-    vna.write(f'display:window1:trace1:feed "{measName}"')
-    vna.write(f'calc1:parameter:select "{measName}"')
-
-    vna.write('initiate:continuous off')
-    vna.write('initiate:immediate')
-    vna.query('*opc?')
-    vna.write('display:window1:y:auto')
+    cmds = [c.format(window=1, trace=1, measName=measName, param='S11') for c in VNA_MEAS_SETUP]
+    vna.write_many(cmds + ['initiate:continuous off', 'initiate:immediate'], wait=True)
 
-    vna.write('format:border swap')
-    vna.write('format real,64')
+    vna.write_many(['display:window1:y:auto', 'format:border swap', f'format {fmt}'])
 
-    meas = vna.query_binary_values('calculate1:data? fdata', datatype='d')
+    meas = vna.query_binary_values('calculate1:data? fdata', datatype=datatype)
     vna.query('*opc?')
 
+    # Stimulus values always use 64 bit format, float32 only resolves about 1 kHz at 10 GHz
+    vna.write('format real,64')
     freq = vna.query_binary_values('calculate1:x?', datatype='d')
     vna.query('*opc?')
 
@@ -70,6 +80,47 @@ def vna_example(ipAddress, port=5025):
     return freq, meas
 
 
+def multi_vna_example(ipAddresses, port=5025):
+    """Runs vna_example on several VNAs at once. Each worker thread owns its own SocketInstrument connection."""
+    # Socket I/O releases the GIL, so threads overlap the time spent waiting on each instrument
+    with ThreadPoolExecutor(max_workers=len(ipAddresses)) as executor:
+        return list(executor.map(lambda ip: vna_example(ip, port=port), ipAddresses))
+
+
+def vna_acquire(ipAddress, port, mnum):
+    """Fetches the trace data of VNA measurement number mnum over its own connection."""
+    vna = socketscpi.SocketInstrument(ipAddress=ipAddress, port=port, timeout=10)
+    vna.write_many(['format:border swap', 'format real,32'])
+    meas = vna.query_binary_values(f'calculate1:measure{mnum}:data? fdata', datatype='f')
+    vna.close()
+
+    return meas
+
+
+def vna_multi_trace_example(ipAddress, port=5025, params=('S11', 'S21', 'S12', 'S22')):
+    """Sets up one VNA trace per S-parameter, sweeps once, and fetches all traces in parallel."""
+    vna = socketscpi.SocketInstrument(ipAddress=ipAddress, port=port, timeout=10)
+    print(vna.instId)
+
+    vna.write('system:fpreset')
+    vna.query('*opc?')
+
+    # Measurements are numbered from 1 in the order they are defined after a preset
+    cmds = []
+    for n, param in enumerate(params, start=1):
+        cmds += [c.format(window=1, trace=n, measName=f'meas{n}', param=param) for c in VNA_MEAS_SETUP]
+    vna.write_many(cmds + ['initiate:continuous off', 'initiate:immediate'], wait=True)
+
+    # Trace fetches are independent, so each one gets its own connection and thread to overlap the transfers
+    with ThreadPoolExecutor(max_workers=len(params)) as executor:
+        traces = list(executor.map(lambda mnum: vna_acquire(ipAddress, port, mnum), range(1, len(params) + 1)))
+
+    vna.err_check()
+    vna.close()
+
+    return dict(zip(params, traces))
+
+
 def scope_example(ipAddress, port=5025):
     # Make connection to instrument
     scope = socketscpi.SocketInstrument(ipAddress, port=port, log=True)
@@ -84,19 +135,13 @@ def scope_example(ipAddress, port=5025):
     scope.write('*rst')
     scope.query('*opc?')
 
-    # Setup up vertical and horizontal ranges
-    scope.write(f'channel{ch}:range {vRange}')
-    scope.write(f'timebase:range {tRange}')
-
-    # Set up trigger mode and level
-    scope.write('trigger:mode edge')
-    scope.write(f'trigger:level channel{ch}, {trigLevel}')
-
-    # Set waveform source
-    scope.write(f'waveform:source channel{ch}')
-
-    # Specify waveform format
-    scope.write('waveform:format byte')
+    # Setup up vertical and horizontal ranges, trigger mode and level, waveform source, and waveform format in one message
+    scope.write_many([f'channel{ch}:range {vRange}',
+                      f'timebase:range {tRange}',
+                      'trigger:mode edge',
+                      f'trigger:level channel{ch}, {trigLevel}',
+                      f'waveform:source channel{ch}',
+                      'waveform:format byte'])
 
     # Capture data
     scope.write('digitize')
@@ -111,9 +156,9 @@ def scope_example(ipAddress, port=5025):
     yOrigin = float(scope.query('waveform:yorigin?'))
     length = len(data)
 
-    # Apply scaling factors
-    time = [(t * xIncrement) + xOrigin for t in range(length)]
-    wfm = [(d * yIncrement) + yOrigin for d in data]
+    # Apply scaling factors (vectorized, data is already an int8 NumPy array)
+    time = np.arange(length, dtype=np.float64) * xIncrement + xOrigin
+    wfm = data * np.float64(yIncrement) + yOrigin
 
     # Check for errors
     scope.err_check()
@@ -125,6 +170,8 @@ def scope_example(ipAddress, port=5025):
 def main():
     # awg_example('127.0.0.1', port=5025)
     # vna_example('127.0.0.1', port=5025)
+    # multi_vna_example(['127.0.0.1', '127.0.0.2'], port=5025)
+    # vna_multi_trace_example('127.0.0.1', port=5025)
     scope_example('192.168.4.195', port=5025)
 
 if __name__ == '__main__':
@@ -9,14 +9,85 @@ reading/writing binary block data, and checking for errors.
 import logging.config
 import warnings
 import socket
+import sys
 import numpy as np
 import ipaddress
+import re
 import logging
-from functools import wraps
+from functools import lru_cache, wraps
+
+# struct module format characters accepted by query_binary_values() and query_ascii_values() and the NumPy data types they decode to
+_DTYPE_MAP = {
+    'b': np.dtype(np.int8),
+    'B': np.dtype(np.uint8),
+    'h': np.dtype(np.int16),
+    'H': np.dtype(np.uint16),
+    'i': np.dtype(np.int32),
+    'l': np.dtype(np.int32),
+    'I': np.dtype(np.uint32),
+    'L': np.dtype(np.uint32),
+    'q': np.dtype(np.int64),
+    'Q': np.dtype(np.uint64),
+    'f': np.dtype(np.float32),
+    'd': np.dtype(np.float64),
+}
+
+# Removes '+' and '-' from syst:err? responses in a single pass
+_ERR_TRIM = str.maketrans('', '', '+-')
+
+# One <code>,"<message>" entry of a syst:err:all? response. A quote inside the message is sent doubled ("").
+_ERR_ENTRY = re.compile(r'([+-]?\d+),("(?:[^"]|"")*")')
+
+# Asks recv() to wait for the full requested size. Only usable on a blocking socket (timeout=None), and left out on Windows, which rejects it on sockets that have ever had a timeout.
+_MSG_WAITALL = 0 if sys.platform == 'win32' else getattr(socket, 'MSG_WAITALL', 0)
+
+# Minimum free space in the receive buffer for each socket receive
+_RECV_CHUNK = 65536
+
+# Largest payload a binblock header can describe (<x> is a single digit, so at most 9 digits of byte count)
+_MAX_BINBLOCK_BYTES = 1_000_000_000
+
+# IP type of service value requesting low delay handling
+_IPTOS_LOWDELAY = 0x10
+
+# Standard Event Status Register error bits: query error, device dependent error, execution error, command error
+_ESR_ERROR_BITS = 0x04 | 0x08 | 0x10 | 0x20
+
+
+@lru_cache(maxsize=128)
+def _validate_ip(ipAddress):
+    """Raises ValueError for an invalid IP address. Results are cached so reconnecting to the same instrument skips parsing."""
+    ipaddress.ip_address(ipAddress)
+
+
+@lru_cache(maxsize=64)
+def _lookup_dtype(datatype):
+    """Returns the NumPy dtype for a struct format character or a numeric NumPy data type, or None if datatype is invalid. Results are cached so repeated reads skip dtype parsing."""
+    dtype = _DTYPE_MAP.get(datatype)
+    if dtype is not None or datatype is None:
+        return dtype
+    try:
+        dtype = np.dtype(datatype)
+    except TypeError:
+        return None
+    # Only fixed size numeric types can be filled from raw instrument bytes. Object, string, and void types cannot.
+    if dtype.kind not in 'biufc' or dtype.itemsize == 0:
+        return None
+    return dtype
+
+
+def _binblock_header_bytes(numBytes):
+    """Returns the encoded IEEE 488.2 binary block header for a payload of numBytes bytes."""
+    if numBytes >= _MAX_BINBLOCK_BYTES:
+        raise BinblockError(f"Maximum binblockwrite length is 1 GB, requested data length is {numBytes/1e9} GB.")
+
+    # bytes formatting produces the header ready to send, with no str-to-bytes encode step
+    count = b'%d' % numBytes
+    return b'#%d%s' % (len(count), count)
 
 
 class SocketInstrument:
-    def __init__(self, ipAddress, port=5025, timeout=10, noDelay=True, globalErrCheck=False, verboseErrCheck=False, log=False, logFile=r'C:\Temp\log.txt'):
+    def __init__(self, ipAddress, port=5025, timeout=10, noDelay=True, globalErrCheck=False, verboseErrCheck=False, log=False, logFile=r'C:\Temp\log.txt', rcvBuf=None, sndBuf=None, keepAlive=True, errCheckMode='full', bulkErrCheck=False):
         """
         Open socket connection with settings for instrument control.
 
@@ -29,6 +100,16 @@ class SocketInstrument:
             verboseErrCheck (bool): Determines if verbose error checking will be attempted.
             log (bool): Turns logging on or off.
             logFile (str): Absolute file path to save log file.
+            rcvBuf (int): Socket receive buffer size in bytes, or None (default) to keep the OS default. A large buffer keeps the TCP window open during large binblock transfers
+                on systems that do not size buffers automatically. On Linux, setting it turns off buffer autotuning and is capped by net.core.rmem_max.
+            sndBuf (int): Socket send buffer size in bytes, or None (default) to keep the OS default. A large buffer keeps more data in flight during large binblock writes
+                on systems that do not size buffers automatically. On Linux, setting it turns off buffer autotuning and is capped by net.core.wmem_max.
+            keepAlive (bool): Turns on TCP keepalive so a connection that sits idle for a long time is not silently dropped.
+            errCheckMode (str): How automatic error checking is done when globalErrCheck is enabled. 'full' reads the error queue
+                after every command. 'inline' appends *esr? to each command and reads the error queue only if an error bit is set.
+                Commands sent with write() that contain a query ('?') always use the full check.
+            bulkErrCheck (bool): Reads the whole error queue with one syst:err:all? query in err_check() instead of one syst:err? query per error.
+                Falls back to syst:err? automatically if the instrument does not support syst:err:all?.
         """
         
         self.log = log
@@ -39,27 +120,55 @@ class SocketInstrument:
             # Allows writing of entire arrays rather than truncated arrays when logging the return from query_binary_values()
             np.set_printoptions(threshold=np.inf)
             logging.basicConfig(filename=logFile, level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+            # The module logger is shared, so undo the settings of any earlier instance that had logging turned off
+            self.logger.propagate = True
         else:
             self.logger.addHandler(logging.NullHandler())
             self.logger.propagate = False
         
         # Validate IP address (will raise an error if given an invalid address).
-        ipaddress.ip_address(ipAddress)
+        _validate_ip(ipAddress)
+
+        if errCheckMode not in ('full', 'inline'):
+            raise SockInstError("errCheckMode must be 'full' or 'inline'.")
 
         self.globalErrCheck = globalErrCheck
+        self.errCheckMode = errCheckMode
+        self.bulkErrCheck = bulkErrCheck
         self.timeout = timeout
 
+        # Receive buffer shared by all read methods. Bytes received beyond the end of one response are kept for the next read.
+        self._rxBuf = bytearray(4 * _RECV_CHUNK)
+        self._rxView = memoryview(self._rxBuf)
+        self._rxStart = 0
+        self._rxEnd = 0
+        # Payload buffer reused by query_binary_values(copy=False).
+        self._binBuf = np.empty(0, dtype=np.uint8)
+
         # Create socket object
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         # Handle
         if noDelay:
             self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
-        # Turn blocking behavior off so we can control the socket while it processes commands
-        self.socket.setblocking(False)
-        # Set timeout
+        # Receive buffer must be set before connecting so the TCP window scale is negotiated accordingly
+        if rcvBuf:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvBuf)
+        if sndBuf:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, sndBuf)
+        if keepAlive:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        # Mark packets as low delay traffic for switches and routers that honor IP type of service. Not every platform allows setting it.
+        if hasattr(socket, 'IP_TOS'):
+            try:
+                self.socket.setsockopt(socket.IPPROTO_IP, socket.IP_TOS, _IPTOS_LOWDELAY)
+            except OSError:
+                pass
+        # Set timeout (this also puts the socket in timeout mode, so a separate setblocking() call is not needed)
         self.socket.settimeout(timeout)
         # Connect to socket
         self.socket.connect((ipAddress, port))
+        # Acknowledge responses immediately rather than waiting on delayed ACK (Linux only)
+        self._quickack()
 
         # Get the instrument ID
         self.instId = self.query('*idn?', errCheck=False)
@@ -77,14 +186,16 @@ class SocketInstrument:
         @wraps(func)
         def wrapper(self, *args, **kwargs):
             result = func(self, *args, **kwargs)
-            log_string = f"socketscpi.SocketInstrument.{func.__name__}():"
-            if args:
-                log_string += f' Args: {args}'
-            if kwargs:
-                log_string += f' Keyword args: {kwargs}'
-            if result:
-                log_string += f' Returns: {result}'
-            logging.debug(log_string)
+            # Skip building the log message (which may contain entire arrays) unless it will actually be logged
+            if self.log and self.logger.isEnabledFor(logging.DEBUG):
+                log_string = f"socketscpi.SocketInstrument.{func.__name__}():"
+                if args:
+                    log_string += f' Args: {args}'
+                if kwargs:
+                    log_string += f' Keyword args: {kwargs}'
+                if result:
+                    log_string += f' Returns: {result}'
+                self.logger.debug(log_string)
             return result
         return wrapper
 
@@ -93,12 +204,14 @@ class SocketInstrument:
         @wraps(func)
         def wrapper(self, *args, **kwargs):
             result = func(self, *args, **kwargs)
-            log_string = f"socketscpi.SocketInstrument.{func.__name__}():"
-            if args:
-                log_string += f' Args: {args}'
-            if kwargs:
-                log_string += f' Keyword args: {kwargs}'
-            logging.debug(log_string)
+            # Skip building the log message (which may contain entire arrays) unless it will actually be logged
+            if self.log and self.logger.isEnabledFor(logging.DEBUG):
+                log_string = f"socketscpi.SocketInstrument.{func.__name__}():"
+                if args:
+                    log_string += f' Args: {args}'
+                if kwargs:
+                    log_string += f' Keyword args: {kwargs}'
+                self.logger.debug(log_string)
             return result
         return wrapper
 
@@ -127,17 +240,140 @@ class SocketInstrument:
         if not isinstance(cmd, str):
             raise SockInstError('Argument must be a string.')
 
-        msg = '{}\n'.format(cmd)
-        self.socket.send(msg.encode('latin_1'))
-        # msg = '{}\n*esr?'.format(cmd)
-        # ret = self.query(msg)
-        # if (int(ret) != 0):
-        #     raise SockInstError('esr non-zero: {}'.format(ret))
+        # Commands containing a query leave their own response in the output buffer, so they use the full error check instead
+        if errCheck and self.globalErrCheck and self.errCheckMode == 'inline' and '?' not in cmd:
+            # Append *esr? to the command so the status check costs no extra round trip
+            self.socket.sendall(f'{cmd};*esr?\n'.encode('latin_1'))
+            try:
+                esr = self.read_no_logging()
+            except socket.timeout:
+                self.err_check()
+                raise
+            self._esr_check(esr)
+            return
+
+        self.socket.sendall(f'{cmd}\n'.encode('latin_1'))
 
         if errCheck and self.globalErrCheck:
             print(f'WRITE - local: {errCheck}, global: {self.globalErrCheck}, cmd: {cmd}')
             self.err_check()
 
+    def write_many(self, cmds, errCheck=True, wait=False):
+        """
+        Writes several commands to the instrument in a single message using SCPI compound command syntax.
+
+        Args:
+            cmds (list): Documented SCPI commands to be sent to the instrument.
+            errCheck (bool): Local error check flag. Auto error checking will only be done if both global and local error checking is enabled.
+            wait (bool): Appends *opc? to the message and waits for its response, so the commands are complete when this returns.
+        """
+
+        # Commands are separated by ';' and given a leading ':' so each one is parsed from the root of the SCPI tree.
+        # Commands that already start with ':' and common commands (*cls, *opc?, etc.) must not get another one.
+        msg = ';'.join(c if i == 0 or c.startswith((':', '*')) else f':{c}' for i, c in enumerate(cmds))
+        if wait:
+            self.query(f'{msg};*opc?', errCheck=errCheck)
+        else:
+            self.write(msg, errCheck=errCheck)
+
+    def _send_buffers(self, buffers):
+        """Sends a list of bytes-like objects in order without joining them, using sendmsg() where available."""
+
+        if not hasattr(self.socket, 'sendmsg'):
+            for b in buffers:
+                self.socket.sendall(b)
+            return
+
+        buffers = [memoryview(b).cast('B') for b in buffers]
+        while buffers:
+            bytesSent = self.socket.sendmsg(buffers)
+            # Drop buffers that were sent completely and trim the one that was sent partially.
+            while buffers and bytesSent >= buffers[0].nbytes:
+                bytesSent -= buffers.pop(0).nbytes
+            if buffers:
+                buffers[0] = buffers[0][bytesSent:]
+
+    def _quickack(self):
+        """Turns on TCP_QUICKACK where supported. Linux clears the flag on its own, so it is set again after each read."""
+
+        if hasattr(socket, 'TCP_QUICKACK'):
+            try:
+                self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_QUICKACK, 1)
+            except OSError:
+                pass
+
+    def _fill(self):
+        """Receives available data from the socket into the end of the receive buffer."""
+
+        if self._rxStart == self._rxEnd:
+            # Everything has been consumed, start over at the beginning of the buffer.
+            self._rxStart = self._rxEnd = 0
+        elif len(self._rxBuf) - self._rxEnd < _RECV_CHUNK:
+            # Make room so every receive can take at least _RECV_CHUNK bytes.
+            unread = self._rxEnd - self._rxStart
+            if len(self._rxBuf) - unread < _RECV_CHUNK:
+                # Unread data nearly fills the buffer, so double its size.
+                newBuf = bytearray(2 * len(self._rxBuf))
+                newBuf[:unread] = self._rxView[self._rxStart:self._rxEnd]
+                self._rxBuf = newBuf
+                self._rxView = memoryview(newBuf)
+            else:
+                # Move unread data to the front of the buffer.
+                self._rxBuf[:unread] = bytes(self._rxView[self._rxStart:self._rxEnd])
+            self._rxStart = 0
+            self._rxEnd = unread
+
+        bytesRecv = self.socket.recv_into(self._rxView[self._rxEnd:])
+        if not bytesRecv:
+            raise SockInstError('Connection closed by instrument.')
+        self._rxEnd += bytesRecv
+
+    def _fill_to(self, numBytes):
+        """Receives from the socket until at least numBytes unread bytes are in the receive buffer."""
+
+        while self._rxEnd - self._rxStart < numBytes:
+            self._fill()
+
+    def _recv_exact(self, numBytes):
+        """Returns exactly numBytes bytes, taken from the receive buffer first and the socket only when needed."""
+
+        self._fill_to(numBytes)
+
+        data = bytes(self._rxView[self._rxStart:self._rxStart + numBytes])
+        self._rxStart += numBytes
+        return data
+
+    def _discard(self, numBytes):
+        """Drops the next numBytes bytes, taken from the receive buffer first and the socket only when needed."""
+
+        while numBytes:
+            if self._rxStart == self._rxEnd:
+                self._fill()
+            dropped = min(numBytes, self._rxEnd - self._rxStart)
+            self._rxStart += dropped
+            numBytes -= dropped
+
+    def _read_until(self, term=b'\n'):
+        """
+        Returns everything up to and including the next term byte, taken from the receive buffer first and the socket only when needed.
+
+        The result is a memoryview into the receive buffer rather than a copy, so it must be used before the next read.
+        """
+
+        scanStart = self._rxStart
+        while True:
+            idx = self._rxBuf.find(term, scanStart, self._rxEnd)
+            if idx != -1:
+                break
+            # Only scan newly received bytes on the next pass. _fill() may move unread data, so track the offset from _rxStart.
+            scanned = self._rxEnd - self._rxStart
+            self._fill()
+            scanStart = self._rxStart + scanned
+
+        data = self._rxView[self._rxStart:idx + 1]
+        self._rxStart = idx + 1
+        return data
+
     def read_no_logging(self):
         """
         Reads the output buffer of the instrument.
@@ -145,12 +381,11 @@ class SocketInstrument:
         Returns (string): Contents of the instrument's output buffer.
         """
 
-        response = b''
-        while response[-1:] != b'\n':
-            response += self.socket.recv(1024)
+        response = self._read_until(b'\n')
+        self._quickack()
 
-        # Strip out whitespace and return.
-        return response.decode('latin_1').strip()
+        # Decode straight from the receive buffer, strip out whitespace, and return.
+        return str(response, 'latin_1').strip()
 
     @log_arguments_and_returns
     def read(self):
@@ -160,12 +395,11 @@ class SocketInstrument:
         Returns (string): Contents of the instrument's output buffer.
         """
 
-        response = b''
-        while response[-1:] != b'\n':
-            response += self.socket.recv(1024)
+        response = self._read_until(b'\n')
+        self._quickack()
 
-        # Strip out whitespace and return.
-        return response.decode('latin_1').strip()
+        # Decode straight from the receive buffer, strip out whitespace, and return.
+        return str(response, 'latin_1').strip()
 
     def query(self, cmd, errCheck=True):
         """
@@ -183,6 +417,22 @@ class SocketInstrument:
         if '?' not in cmd:
             raise SockInstError('Query must include "?"')
 
+        if errCheck and self.globalErrCheck and self.errCheckMode == 'inline':
+            # Append *esr? to the query, the instrument returns both responses on one line separated by ';'
+            self.write(f'{cmd};*esr?', errCheck=False)
+            try:
+                response = self.read()
+            except socket.timeout:
+                self.err_check()
+                raise
+            if ';' not in response:
+                # A query that fails returns nothing, leaving only the *esr? response
+                self._esr_check(response)
+                raise SockInstError(f'No response to "{cmd}".')
+            result, esr = response.rsplit(';', 1)
+            self._esr_check(esr)
+            return result
+
         self.write(cmd, errCheck=False)
         try:
             result = self.read()
@@ -195,25 +445,95 @@ class SocketInstrument:
 
         return result
 
+    def query_ascii_values(self, cmd, datatype='d', separator=',', errCheck=True):
+        """
+        Sends query to instrument and parses a response of separated ASCII numbers into a NumPy array.
+
+        Binary transfers with query_binary_values() are faster and should be used when the instrument supports them.
+
+        Args:
+            cmd (string): Documented SCPI query that causes the instrument to return ASCII numeric data.
+            datatype (string): Data type for the returned data. Uses the same naming convention as Python's struct module
+                https://docs.python.org/3/library/struct.html#format-characters
+                NumPy data types such as np.int16 are also accepted.
+            separator (string): Character that separates values in the response.
+            errCheck (bool): Local error check flag. Auto error checking will only be done if both global and local error checking is enabled.
+
+        Returns (NumPy ndarray): Array containing the values from the instrument's output buffer.
+        """
+
+        dtype = _lookup_dtype(datatype)
+        if dtype is None:
+            raise SockInstError('Invalid data type selected.')
+
+        response = self.query(cmd, errCheck=errCheck)
+        if not response:
+            return np.empty(0, dtype=dtype)
+
+        # NumPy converts every value in one call and, unlike np.fromstring(), raises on any value that does not parse
+        try:
+            return np.array(response.split(separator), dtype=dtype)
+        except ValueError:
+            raise SockInstError(f'Response is not a list of {dtype} values separated by "{separator}": {response}')
+
+    def _esr_check(self, esr):
+        """Reads the full error queue with err_check() only if a *esr? response has any error bits set."""
+
+        if int(esr) & _ESR_ERROR_BITS:
+            self.err_check()
+
     def err_check(self):
         """Prints out all errors and clears error queue. Raises SockInstError with the info of the error encountered."""
 
+        probeFailed = False
+        if self.bulkErrCheck:
+            err = self._read_error_queue()
+            if err is None:
+                probeFailed = True
+            else:
+                for e in err:
+                    logging.error(e)
+                if err:
+                    raise SockInstError(err)
+                return
+
         err = []
         cmd = 'system:error?'
 
-        # syst:err? response format varies between instrument families, so remove whitespace and extra characters before checking
-        temp = self.query(cmd, errCheck=False).strip().replace('+', '').replace('-', '')
-
         # Read all errors until none are left. Generally, instruments return a message that begins with the string '0,"No error'.
-        while '0,"No error' not in temp:
+        # syst:err? response format varies between instrument families, so remove whitespace and extra characters before checking,
+        # but report the error exactly as the instrument returned it.
+        temp = self.query(cmd, errCheck=False).strip()
+        while '0,"No error' not in temp.translate(_ERR_TRIM):
             # Log each error message
             logging.error(temp)
             # Build list of errors
             err.append(temp)
-            temp = self.query(cmd, errCheck=False).strip().replace('+', '').replace('-', '')
+            temp = self.query(cmd, errCheck=False).strip()
+
+        # Drop the "Undefined header" error caused by an unsupported syst:err:all? query
+        if probeFailed and err and err[-1].startswith('-113'):
+            err.pop()
         if err:
             raise SockInstError(err)
 
+    def _read_error_queue(self):
+        """
+        Reads the entire error queue with a single syst:err:all? query.
+
+        Returns (list): Errors in the queue, or None if the instrument does not answer syst:err:all?. Bulk error checking is then turned off.
+        """
+
+        self.write('system:error:all?', errCheck=False)
+        try:
+            # Instruments that do not support the query send no response. Wait the full timeout so a slow answer is not left in the stream.
+            response = self.read_no_logging()
+        except socket.timeout:
+            self.bulkErrCheck = False
+            return None
+
+        return [f'{code},{msg}' for code, msg in _ERR_ENTRY.findall(response) if int(code) != 0]
+
     def binblockread(self, cmd, datatype='b', debug=False, errCheck=True):
         """DEPRECATED. THIS IS A PASS-THROUGH FUNCTION ONLY."""
 
@@ -222,7 +542,7 @@ class SocketInstrument:
         return self.query_binary_values(cmd, datatype=datatype, debug=debug, errCheck=errCheck)
 
     @log_arguments_only
-    def query_binary_values(self, cmd, datatype='b', debug=False, errCheck=True):
+    def query_binary_values(self, cmd, datatype='b', debug=False, errCheck=True, copy=True, byteorder=None):
         """
         Send a command and parses response in IEEE 488.2 binary block format.
 
@@ -241,65 +561,89 @@ class SocketInstrument:
             cmd (string): Documented SCPI query that causes the instrument to return a binary block.
             datatype (string): Data type for the returned data. Uses the same naming convention as Python's struct module
                 https://docs.python.org/3/library/struct.html#format-characters
+                NumPy data types such as np.int16 are also accepted.
             debug (bool): Turns debug mode on or off.
             errCheck (bool): Local error check flag. Auto error checking will only be done if both global and local error checking is enabled.
+            copy (bool): True returns a newly allocated array. False receives into a payload buffer that is reused by every call,
+                which avoids allocating memory for each transfer. The returned array is then only valid until the next call
+                with copy=False, so call .copy() on it if it must be kept.
+            byteorder (string): Byte order of the data sent by the instrument, '<' for little endian or '>' for big endian.
+                The returned array uses this byte order directly, so no byteswap() is needed. None uses the native byte order.
 
         Returns (NumPy ndarray): Array containing the data from the instrument buffer.
 
         """
 
         # Decode data type
-        if datatype == 'b':
-            dtype = np.int8
-        elif datatype == 'B':
-            dtype = np.uint8
-        elif datatype == 'h':
-            dtype = np.int16
-        elif datatype == 'H':
-            dtype = np.uint16
-        elif datatype == 'i' or datatype == 'l':
-            dtype = np.int32
-        elif datatype == 'I' or datatype == 'L':
-            dtype = np.uint32
-        elif datatype == 'q':
-            dtype = np.int64
-        elif datatype == 'Q':
-            dtype = np.uint64
-        elif datatype == 'f':
-            dtype = np.float32
-        elif datatype == 'd':
-            dtype = np.float64
-        else:
+        dtype = _lookup_dtype(datatype)
+        if dtype is None:
             raise BinblockError('Invalid data type selected.')
+        if byteorder:
+            dtype = dtype.newbyteorder(byteorder)
 
         # Send command/query
         self.write(cmd, errCheck=False)
 
-        # Read # character, raise exception if not present.
+        # Wait briefly for # character and header length. A query that caused an error never responds, so check the error queue instead of waiting out the full timeout.
         try:
             self.socket.settimeout(1)
-            if self.socket.recv(1) != b'#':
-                raise BinblockError('Data in buffer is not in binblock format.')
+            self._fill_to(2)
         except socket.timeout:
             self.err_check()
         finally:
             self.socket.settimeout(self.timeout)
 
-        # Extract header length and number of bytes in binblock.
-        headerLength = int(self.socket.recv(1).decode('latin_1'), 16)
-        numBytes = int(self.socket.recv(headerLength).decode('latin_1'))
+        # No error was reported, so keep waiting under the normal timeout, then raise exception if # is not present.
+        self._fill_to(2)
+        if self._rxBuf[self._rxStart] != ord('#'):
+            raise BinblockError('Data in buffer is not in binblock format.')
+
+        # Parse header length and number of bytes in binblock in place. The whole header normally arrived with the first receive.
+        headerLength = self._rxBuf[self._rxStart + 1]
+        # Convert the hex digit straight from its byte value: '0'-'9' are 0x30-0x39, 'A'-'F' and 'a'-'f' map to 10-15 after clearing the lower case bit
+        headerLength = headerLength - 0x30 if headerLength <= 0x39 else (headerLength & 0xDF) - 0x37
+        if not 1 <= headerLength <= 15:
+            raise BinblockError('Invalid binblock header length.')
+        self._fill_to(2 + headerLength)
+        numBytes = int(self._rxBuf[self._rxStart + 2:self._rxStart + 2 + headerLength])
+        self._rxStart += 2 + headerLength
+        self._quickack()
 
         if debug:
             print('Header: #{}{}'.format(headerLength, numBytes))
 
-        # Create a buffer object of the correct size and expose a memoryview for efficient socket reading
-        rawData = bytearray(numBytes)
-        buf = memoryview(rawData)
+        itemSize = dtype.itemsize
+        if numBytes % itemSize:
+            # Drop the payload and terminator first so the next command does not read them as its response
+            self._discard(numBytes + 1)
+            raise BinblockError(f'Binblock length of {numBytes} bytes is not a multiple of the {itemSize} byte data type.')
+
+        if copy:
+            # Receive directly into an uninitialized array of the correct type and expose a byte-level memoryview for efficient socket reading
+            rawData = np.empty(numBytes // itemSize, dtype=dtype)
+            buf = memoryview(rawData).cast('B')
+        else:
+            # Reuse the payload buffer, replacing it only when a larger binblock arrives. np.empty() skips zero-filling memory the socket is about to overwrite.
+            if self._binBuf.nbytes < numBytes:
+                self._binBuf = np.empty(numBytes, dtype=np.uint8)
+            rawData = self._binBuf[:numBytes].view(dtype)
+            buf = memoryview(rawData).cast('B')
+
+        # Start with any payload bytes that arrived in the receive buffer along with the header.
+        buffered = min(self._rxEnd - self._rxStart, numBytes)
+        buf[:buffered] = self._rxView[self._rxStart:self._rxStart + buffered]
+        self._rxStart += buffered
+        buf = buf[buffered:]
+        numBytes -= buffered
 
         # While there is data left to read...
+        # With a timeout set the socket is non-blocking underneath and MSG_WAITALL does nothing, so only ask for it on a blocking socket
+        flags = _MSG_WAITALL if self.socket.gettimeout() is None else 0
         while numBytes:
             # Read data from instrument into buffer.
-            bytesRecv = self.socket.recv_into(buf, numBytes)
+            bytesRecv = self.socket.recv_into(buf, numBytes, flags)
+            if not bytesRecv:
+                raise SockInstError('Connection closed by instrument.')
             # Slice buffer to preserve data already written to it. This syntax seems odd, but it works correctly.
             buf = buf[bytesRecv:]
             # Subtract bytes received from total bytes.
@@ -309,21 +653,21 @@ class SocketInstrument:
                     numBytes, bytesRecv))
 
         # Receive termination character.
-        term = self.socket.recv(1)
+        term = self._recv_exact(1)
         if debug:
             print('Term char: ', term)
         # If term char is incorrect or not present, raise exception.
         if term != b'\n':
             print('Term char: {}, rawData Length: {}'.format(
-                term, len(rawData)))
+                term, rawData.nbytes))
             raise BinblockError('Data not terminated correctly.')
 
         if errCheck and self.globalErrCheck:
             print(f'BINBLOCKREAD - local: {errCheck}, global: {self.globalErrCheck}')
             self.err_check()
 
-        # Convert binary data to NumPy array of specified data type and return.
-        return np.frombuffer(rawData, dtype=dtype)
+        # Data was received in place, so the array is already of the specified data type.
+        return rawData
 
     # noinspection PyUnresolvedReferences
     @staticmethod
@@ -335,11 +679,10 @@ class SocketInstrument:
         NOTE: <x> is a hexadecimal number.
         <yyy> is the number of bytes to transfer. """
 
-        numBytes = memoryview(data).nbytes
-        if numBytes >= 1e9:
-            raise BinblockError(f"Maximum binblockwrite length is 1 GB, requested data length is {numBytes/1e9} GB.")
+        # NumPy arrays know their size, so only other buffer types need a memoryview to find it
+        numBytes = data.nbytes if isinstance(data, np.ndarray) else memoryview(data).nbytes
 
-        return f'#{len(str(numBytes))}{numBytes}'
+        return _binblock_header_bytes(numBytes).decode('latin_1')
 
     def binblockwrite(self, cmd, data, debug=False, errCheck=True):
         """DEPRECATED. THIS IS A PASS-THROUGH FUNCTION ONLY."""
@@ -369,21 +712,39 @@ class SocketInstrument:
         *args and **kwargs added to allow for pyvisa syntax compatibility
        """
 
-        # Generate binary block header from data
-        header = self.binblock_header(data)
+        # Sockets need a contiguous buffer. Sliced or transposed arrays are copied once here; contiguous arrays are sent without any copy.
+        if isinstance(data, np.ndarray) and not data.flags['C_CONTIGUOUS']:
+            data = np.ascontiguousarray(data)
 
-        # Send message, header, data, and termination
-        self.socket.send(cmd.encode('latin_1'))
-        self.socket.send(header.encode('latin_1'))
-        self.socket.sendall(data)
-        self.socket.send(b'\n')
+        # Generate binary block header from data, already encoded for sending
+        payload = memoryview(data).cast('B')
+        header = _binblock_header_bytes(payload.nbytes)
+
+        # In inline mode *esr? follows the binary block, so a write with no errors costs one status read instead of an error queue poll
+        inline = errCheck and self.globalErrCheck and self.errCheckMode == 'inline'
+        end = b';*esr?\n' if inline else b'\n'
+
+        # Send message, header, data, and termination together so they are not split into separate small packets
+        prefix = cmd.encode('latin_1') + header
+        if payload.nbytes < 65536:
+            # Copying a small payload is cheaper than an extra system call
+            self.socket.sendall(prefix + payload + end)
+        else:
+            self._send_buffers([prefix, payload, end])
 
         if debug:
             print(f'binblockwrite --')
             print(f'msg: {cmd}')
-            print(f'header: {header}')
+            print(f'header: {header.decode("latin_1")}')
         
-        if errCheck and self.globalErrCheck:
+        if inline:
+            try:
+                esr = self.read_no_logging()
+            except socket.timeout:
+                self.err_check()
+                raise
+            self._esr_check(esr)
+        elif errCheck and self.globalErrCheck:
             print(f'BINBLOCKWRITE - local: {errCheck}, global: {self.globalErrCheck}')
             self.err_check()
 
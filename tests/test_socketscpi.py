@@ -4,12 +4,68 @@
 """Tests for `socketscpi` package."""
 
 
+import socket
+import threading
 import unittest
 from click.testing import CliRunner
 
+import numpy as np
+
 import socketscpi
 
 
+class FakeInstrument:
+    """Minimal SCPI socket server on localhost that answers queries from a dict of canned responses.
+
+    A response may also be a list, which is returned one item per query until only the last item is left.
+    """
+
+    def __init__(self, responses=None):
+        self.responses = {'*idn?': b'FAKE,INSTRUMENT,0,0\n', '*opc?': b'1\n', 'system:error?': b'+0,"No error"\n'}
+        self.responses.update(responses or {})
+        self.received = []
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.bind(('127.0.0.1', 0))
+        self.server.listen(1)
+        self.port = self.server.getsockname()[1]
+        threading.Thread(target=self.serve, daemon=True).start()
+
+    def serve(self):
+        conn, _ = self.server.accept()
+        with conn:
+            data = b''
+            while True:
+                chunk = conn.recv(65536)
+                if not chunk:
+                    return
+                data += chunk
+                while b'\n' in data:
+                    line, data = data.split(b'\n', 1)
+                    cmd = line.decode('latin_1')
+                    self.received.append(cmd)
+                    response = self.responses.get(cmd)
+                    if isinstance(response, list):
+                        response = response.pop(0) if len(response) > 1 else response[0]
+                    if response is not None:
+                        conn.sendall(response)
+
+    def close(self):
+        self.server.close()
+
+
+class ShortSendSocket:
+    """Stand-in for a socket whose sendmsg() sends only a few bytes per call, like a full kernel send buffer."""
+
+    def __init__(self, limit=7):
+        self.limit = limit
+        self.sent = bytearray()
+
+    def sendmsg(self, buffers):
+        data = b''.join(bytes(b) for b in buffers)[:self.limit]
+        self.sent += data
+        return len(data)
+
+
 class TestSocketscpi(unittest.TestCase):
     """Tests for `socketscpi` package."""
 
@@ -31,3 +87,225 @@ class TestSocketscpi(unittest.TestCase):
         help_result = runner.invoke(cli.main, ['--help'])
         assert help_result.exit_code == 0
         assert '--help  Show this message and exit.' in help_result.output
+
+
+class TestSocketInstrument(unittest.TestCase):
+    """Tests for `socketscpi.SocketInstrument` against a local fake instrument."""
+
+    def connect(self, responses=None):
+        fake = FakeInstrument(responses)
+        self.addCleanup(fake.close)
+        inst = socketscpi.SocketInstrument('127.0.0.1', port=fake.port)
+        self.addCleanup(inst.close)
+        return fake, inst
+
+    def test_query_ascii_values(self):
+        """Comma separated ASCII data is parsed into an array of the requested type."""
+        _, inst = self.connect({'trace:data?': b'+1.5E+00,-2,3\n', 'counts?': b'1,-2,3\n'})
+        values = inst.query_ascii_values('trace:data?')
+        self.assertEqual(values.dtype, np.float64)
+        np.testing.assert_array_equal(values, [1.5, -2, 3])
+        np.testing.assert_array_equal(inst.query_ascii_values('counts?', datatype='h'), np.array([1, -2, 3], dtype=np.int16))
+
+    def test_query_ascii_values_malformed(self):
+        """A response with a value that does not parse raises SockInstError instead of returning partial data."""
+        _, inst = self.connect({'trace:data?': b'1,2,abc\n'})
+        with self.assertRaises(socketscpi.SockInstError):
+            inst.query_ascii_values('trace:data?')
+
+    def test_query_binary_values(self):
+        """Binblock header is parsed and the payload is returned with the requested type."""
+        data = np.arange(-500, 500, dtype=np.int16)
+        payload = data.tobytes()
+        block = f'#{len(str(len(payload)))}{len(payload)}'.encode('latin_1') + payload + b'\n'
+        _, inst = self.connect({'waveform:data?': block})
+        np.testing.assert_array_equal(inst.query_binary_values('waveform:data?', datatype='h'), data)
+        # NumPy data types work the same as struct format characters
+        np.testing.assert_array_equal(inst.query_binary_values('waveform:data?', datatype=np.int16), data)
+        # Non-numeric data types are rejected before the query is sent
+        for datatype in ('O', 'S', None):
+            with self.assertRaises(socketscpi.BinblockError):
+                inst.query_binary_values('waveform:data?', datatype=datatype)
+        # Data following the binblock must still be readable
+        self.assertEqual(inst.query('*opc?'), '1')
+
+    def test_query_binary_values_bad_length(self):
+        """A payload that does not divide into whole items raises BinblockError and is drained from the connection."""
+        _, inst = self.connect({'waveform:data?': b'#13abc\n'})
+        with self.assertRaises(socketscpi.BinblockError):
+            inst.query_binary_values('waveform:data?', datatype='h')
+        self.assertEqual(inst.query('*opc?'), '1')
+
+    def test_query_binary_values_connection_closed(self):
+        """An instrument that disconnects partway through the payload raises SockInstError instead of hanging."""
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.addCleanup(server.close)
+        server.bind(('127.0.0.1', 0))
+        server.listen(1)
+
+        def serve():
+            conn, _ = server.accept()
+            with conn:
+                conn.recv(1024)
+                conn.sendall(b'FAKE,INSTRUMENT,0,0\n')
+                conn.recv(1024)
+                conn.sendall(b'#3100' + bytes(range(20, 70)))
+
+        threading.Thread(target=serve, daemon=True).start()
+        inst = socketscpi.SocketInstrument('127.0.0.1', port=server.getsockname()[1])
+        with self.assertRaises(socketscpi.SockInstError):
+            inst.query_binary_values('waveform:data?')
+        inst.socket.close()
+
+    def test_query_binary_values_no_response(self):
+        """A binblock query that never responds and leaves no error times out instead of parsing old data."""
+        fake = FakeInstrument()
+        self.addCleanup(fake.close)
+        inst = socketscpi.SocketInstrument('127.0.0.1', port=fake.port, timeout=0.5)
+        self.addCleanup(inst.close)
+        with self.assertRaises(socket.timeout):
+            inst.query_binary_values('waveform:data?')
+        self.assertEqual(fake.received[-2:], ['waveform:data?', 'system:error?'])
+
+    def test_inline_err_check(self):
+        """Inline error checking appends *esr? to the command and only reads the error queue when an error bit is set."""
+        fake = FakeInstrument({'freq 1e9;*esr?': b'+0\n', 'freq -1;*esr?': b'+16\n', 'system:error?': [b'-222,"Data out of range"\n', b'+0,"No error"\n']})
+        self.addCleanup(fake.close)
+        inst = socketscpi.SocketInstrument('127.0.0.1', port=fake.port, globalErrCheck=True, errCheckMode='inline')
+        self.addCleanup(inst.close)
+        inst.write('freq 1e9')
+        with self.assertRaises(socketscpi.SockInstError):
+            inst.write('freq -1')
+        self.assertEqual(fake.received[-4:], ['freq 1e9;*esr?', 'freq -1;*esr?', 'system:error?', 'system:error?'])
+
+    def test_inline_err_check_failed_query(self):
+        """A query that fails and returns only the *esr? response raises the instrument's error."""
+        fake = FakeInstrument({'meas?;*esr?': b'+16\n', 'system:error?': [b'-221,"Settings conflict"\n', b'+0,"No error"\n']})
+        self.addCleanup(fake.close)
+        inst = socketscpi.SocketInstrument('127.0.0.1', port=fake.port, globalErrCheck=True, errCheckMode='inline')
+        self.addCleanup(inst.close)
+        with self.assertRaises(socketscpi.SockInstError) as ctx:
+            inst.query('meas?')
+        self.assertEqual(ctx.exception.args[0], ['-221,"Settings conflict"'])
+
+    def test_binblock_header(self):
+        """Header holds the digit count followed by the byte count of the data."""
+        self.assertEqual(socketscpi.SocketInstrument.binblock_header(np.zeros(500, dtype=np.int8)), '#3500')
+        self.assertEqual(socketscpi.SocketInstrument.binblock_header(np.zeros(5, dtype=np.float64)), '#240')
+
+    def test_write_binary_values_non_contiguous(self):
+        """Strided arrays are sent in logical order."""
+        fake, inst = self.connect({'trace:data?': b'\n'})
+        data = np.arange(100, 140, dtype=np.int16)[::2]
+        inst.write_binary_values('trace:data ', data)
+        self.assertEqual(inst.query('*opc?'), '1')
+        self.assertEqual(fake.received[-2].encode('latin_1'), b'trace:data #240' + data.tobytes())
+
+    def test_write_binary_values_inline_err_check(self):
+        """Inline error checking appends *esr? after the binary block and skips the error queue when no error bit is set."""
+        data = np.arange(100, 120, dtype=np.int16)
+        message = b'trace:data #240' + data.tobytes() + b';*esr?'
+        fake = FakeInstrument({message.decode('latin_1'): b'+0\n'})
+        self.addCleanup(fake.close)
+        inst = socketscpi.SocketInstrument('127.0.0.1', port=fake.port, globalErrCheck=True, errCheckMode='inline')
+        self.addCleanup(inst.close)
+        inst.write_binary_values('trace:data ', data)
+        self.assertEqual(inst.query('*opc?', errCheck=False), '1')
+        self.assertEqual(fake.received[-2:], [message.decode('latin_1'), '*opc?'])
+
+    def test_query_binary_values_byteorder(self):
+        """Big endian data is interpreted in place when byteorder='>'."""
+        data = np.linspace(-1, 1, 16)
+        payload = data.astype('>f8').tobytes()
+        _, inst = self.connect({'calc:data?': f'#3{len(payload)}'.encode('latin_1') + payload + b'\n'})
+        np.testing.assert_array_equal(inst.query_binary_values('calc:data?', datatype='d', byteorder='>'), data)
+
+    def test_write_many(self):
+        """Commands are joined into one message, optionally followed by *opc?."""
+        fake, inst = self.connect({'freq 1e9;:pow -10;*opc?': b'1\n'})
+        inst.write_many(['init:cont off', 'init:imm'])
+        inst.write_many(['freq 1e9', 'pow -10'], wait=True)
+        self.assertEqual(fake.received[-2:], ['init:cont off;:init:imm', 'freq 1e9;:pow -10;*opc?'])
+
+    def test_write_many_rooted_and_common(self):
+        """Commands that already start with ':' or are common commands are joined without an extra ':'."""
+        fake, inst = self.connect()
+        inst.write_many([':sense:freq 1e9', ':sense:pow -10', '*cls', 'init:imm'])
+        self.assertEqual(inst.query('*opc?'), '1')
+        self.assertEqual(fake.received[-2], ':sense:freq 1e9;:sense:pow -10;*cls;:init:imm')
+
+    def test_send_buffers_partial(self):
+        """Partial sendmsg() calls resume where they stopped, including in the middle of a buffer."""
+        _, inst = self.connect()
+        data = np.arange(100, 120, dtype=np.int16)
+        sock, inst.socket = inst.socket, ShortSendSocket()
+        try:
+            inst._send_buffers([b'trace:data #240', data, b'\n'])
+            sent = inst.socket.sent
+        finally:
+            inst.socket = sock
+        self.assertEqual(bytes(sent), b'trace:data #240' + data.tobytes() + b'\n')
+
+    def test_write_binary_values_large(self):
+        """Payloads of 64 kB and more are sent without joining them to the header."""
+        fake, inst = self.connect()
+        # Values are chosen so that no byte is a newline, which would split the message in the fake instrument
+        data = (np.arange(100_000) % 200 + 0x2020).astype(np.int16)
+        inst.write_binary_values('trace:data ', data)
+        self.assertEqual(inst.query('*opc?'), '1')
+        self.assertEqual(fake.received[-2].encode('latin_1'), b'trace:data #6200000' + data.tobytes())
+
+    def test_query_binary_values_no_copy(self):
+        """copy=False reuses one payload buffer and grows it when a larger binblock arrives."""
+        small = np.arange(-50, 50, dtype=np.int8)
+        large = np.arange(-500, 500, dtype=np.int16)
+        _, inst = self.connect({'small?': b'#3100' + small.tobytes() + b'\n', 'large?': b'#42000' + large.tobytes() + b'\n'})
+        first = inst.query_binary_values('small?', copy=False)
+        np.testing.assert_array_equal(first, small)
+        second = inst.query_binary_values('small?', copy=False)
+        self.assertTrue(np.shares_memory(first, second))
+        grown = inst.query_binary_values('large?', datatype='h', copy=False)
+        np.testing.assert_array_equal(grown, large)
+        self.assertFalse(np.shares_memory(first, grown))
+        self.assertTrue(np.shares_memory(grown, inst.query_binary_values('small?', copy=False)))
+        # copy=True always returns a new array
+        self.assertFalse(np.shares_memory(inst.query_binary_values('small?'), inst.query_binary_values('small?')))
+
+    def test_read_long_responses(self):
+        """Responses longer than the receive buffer are read whole after the buffer is compacted or enlarged."""
+        lines = [b'1' * 150_000, b'2' * 150_000, b'3' * 600_000]
+        _, inst = self.connect({'lines?': lines[0] + b'\n' + lines[1] + b'\n', 'long?': lines[2] + b'\n'})
+        # The second line starts partway through the buffer, so reading it moves the unread data to the front
+        self.assertEqual(inst.query('lines?'), lines[0].decode())
+        self.assertEqual(inst.read(), lines[1].decode())
+        # This line does not fit in the buffer at all, so the buffer is enlarged
+        self.assertEqual(inst.query('long?'), lines[2].decode())
+        self.assertEqual(inst.query('*opc?'), '1')
+
+    def test_err_check_keeps_sign(self):
+        """Errors are reported exactly as the instrument returned them."""
+        _, inst = self.connect({'system:error?': [b'-113,"Undefined header"\n', b'+0,"No error"\n']})
+        with self.assertRaises(socketscpi.SockInstError) as ctx:
+            inst.err_check()
+        self.assertEqual(ctx.exception.args[0], ['-113,"Undefined header"'])
+
+    def test_bulk_err_check(self):
+        """The whole error queue is read with one syst:err:all? query."""
+        fake = FakeInstrument({'system:error:all?': [b'-222,"Data out of range",-113,"Undefined header; ""freq"""\n', b'+0,"No error"\n']})
+        self.addCleanup(fake.close)
+        inst = socketscpi.SocketInstrument('127.0.0.1', port=fake.port, bulkErrCheck=True)
+        self.addCleanup(inst.close)
+        with self.assertRaises(socketscpi.SockInstError) as ctx:
+            inst.err_check()
+        self.assertEqual(ctx.exception.args[0], ['-222,"Data out of range"', '-113,"Undefined header; ""freq"""'])
+        inst.err_check()
+        self.assertNotIn('system:error?', fake.received)
+
+    def test_bulk_err_check_fallback(self):
+        """Instruments without syst:err:all? fall back to syst:err? without reporting the probe's own error."""
+        fake = FakeInstrument({'system:error?': [b'-113,"Undefined header"\n', b'+0,"No error"\n']})
+        self.addCleanup(fake.close)
+        inst = socketscpi.SocketInstrument('127.0.0.1', port=fake.port, timeout=0.5, bulkErrCheck=True)
+        self.addCleanup(inst.close)
+        inst.err_check()
+        self.assertFalse(inst.bulkErrCheck)